@@ -27,22 +27,31 @@ import calendar
 import sqlite3
 import time
 import hashlib
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import importlib.util
+import json
+import threading
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
+from pathlib import Path
 from datetime import datetime, date, timedelta, timezone
-from typing import List, Optional, Tuple, Dict, Any
+from types import MappingProxyType
+from typing import List, Optional, Tuple, Dict, Any, Mapping, Union
 
 import numpy as np
 import streamlit as st
+import streamlit.components.v1 as components
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import googlemaps
-import polyline
-import folium
-from streamlit_folium import st_folium
 
 import pandas as pd
 import requests
 
 from timesheet import show_timesheet
+# Helpers purs dans un module importé : leurs lru_cache survivent aux reruns
+from app_helpers import (
+    normalize_ca_postal, parse_latlon, parse_ts_utc, norm_name, norm_upper, big_number_marker_html,
+)
 
 from zoneinfo import ZoneInfo
 TZ_LOCAL = ZoneInfo("America/Montreal")
@@ -54,14 +63,19 @@ try:
 except ImportError:
     ORTOOLS_AVAILABLE = False
 
+# python-calamine — lecteur xlsx (Rust) plus rapide qu'openpyxl (pip install python-calamine)
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = "openpyxl"
+
 # ────────────────────────────────────────────────────────────────
 # Optional myGeotab import
 # ────────────────────────────────────────────────────────────────
-GEOTAB_AVAILABLE = True
-try:
-    import mygeotab as myg
-except Exception:
-    GEOTAB_AVAILABLE = False
+# (présence vérifiée sans import : mygeotab n'est chargé qu'à la 1re connexion Geotab ;
+#  un échec d'import à ce moment-là est rattrapé dans l'onglet Geotab)
+GEOTAB_AVAILABLE = importlib.util.find_spec("mygeotab") is not None
 
 # ────────────────────────────────────────────────────────────────
 # Page config (ONE TIME)
@@ -93,29 +107,41 @@ else:
 
 page = st.session_state.page
 # ────────────────────────────────────────────────────────────────
-# [FAIBLE-1] Header — logo path caché pour éviter 6x os.path.exists() par rerun
+# [FAIBLE-1] Header — logo path résolu une seule fois par process
+# (st.cache_resource : survit aux reruns, pas de stat() ni de copie du résultat)
 # ────────────────────────────────────────────────────────────────
-@st.cache_data(ttl=3600, show_spinner=False)
+LOGO_CANDIDATES = (
+    "Cummins_Logo.png", "Cummins_Logo.jpg", "Cummins_Logo.svg",
+    "assets/cummins_black.svg", "assets/cummins_black.png", "assets/cummins_black.jpg",
+)
+
+@st.cache_resource(show_spinner=False)
 def find_logo_path() -> Optional[str]:
-    candidates = [
-        "Cummins_Logo.png", "Cummins_Logo.jpg", "Cummins_Logo.svg",
-        "assets/cummins_black.svg", "assets/cummins_black.png", "assets/cummins_black.jpg",
-    ]
-    for path in candidates:
-        if os.path.exists(path):
-            return path
+    for candidate in LOGO_CANDIDATES:
+        path = Path(candidate)
+        if path.is_file():
+            return str(path)
     return None
 
+@st.cache_resource(show_spinner=False)
+def load_logo() -> Optional[Any]:
+    # Contenu lu une seule fois par process (bytes ; texte pour un SVG)
+    path = find_logo_path()
+    if not path:
+        return None
+    data = Path(path).read_bytes()
+    return data.decode("utf-8") if path.endswith(".svg") else data
+
 def cummins_header():
     col_logo, col_title = st.columns([1, 5], vertical_alignment="center")
     with col_logo:
-        logo_path = find_logo_path()
-        if logo_path:
+        logo = load_logo()
+        if logo:
             try:
-                st.image(logo_path, width=300)
+                st.image(logo, width=300)
             except Exception:
-                logo_path = None
-        if not logo_path:
+                logo = None
+        if not logo:
             st.markdown(
                 """
                 <div style="width:150px;height:150px;display:flex;align-items:center;justify-content:center;">
@@ -144,42 +170,81 @@ def cummins_header():
 # ────────────────────────────────────────────────────────────────
 # Helpers
 # ────────────────────────────────────────────────────────────────
-def secret(name: str, default: Optional[str] = None) -> Optional[str]:
+@st.cache_resource(show_spinner=False)
+def _secrets_snapshot() -> Mapping[str, Any]:
+    # secrets.toml lu une fois par process (absent → {}), plus de try/except par appel
     try:
-        return st.secrets[name]
+        return MappingProxyType(dict(st.secrets))
     except Exception:
-        return os.getenv(name, default)
+        return MappingProxyType({})
 
-def normalize_ca_postal(text: str) -> str:
-    if not text:
-        return text
-    t = str(text).strip().upper().replace(" ", "")
-    if len(t) == 6 and t[:3].isalnum() and t[3:].isalnum():
-        return f"{t[:3]} {t[3:]}, Canada"
-    return text
-
-def big_number_marker(n: str, color_hex: str = "#cc3333"):
-    html = f"""
-    <div style="
-      background:{color_hex};
-      color:white;
-      border-radius:18px;
-      width:36px;height:36px;
-      display:flex;align-items:center;justify-content:center;
-      font-weight:700;font-size:16px;border:2px solid #222;">
-      {n}
-    </div>
-    """
-    return folium.DivIcon(html=html)
+def secret(name: str, default: Optional[str] = None) -> Optional[str]:
+    val = _secrets_snapshot().get(name)
+    return val if val is not None else os.getenv(name, default)
 
-def recency_color(ts: Optional[str]) -> Tuple[str, str]:
+def decode_polyline(encoded: str, precision: int = 5) -> np.ndarray:
+    """
+    Décode une polyline Google encodée → array (N, 2) [lat, lon].
+    Vectorisé NumPy : découpage des varints par masque 0x20, somme des blocs
+    de 5 bits par np.add.reduceat, zigzag puis cumsum des deltas.
+    """
+    if not encoded:
+        return np.empty((0, 2), dtype=np.float64)
+    raw = np.frombuffer(encoded.encode("ascii"), dtype=np.uint8).astype(np.int64) - 63
+    ends = np.flatnonzero((raw & 0x20) == 0)  # dernier octet de chaque varint
+    if ends.size < 2:
+        return np.empty((0, 2), dtype=np.float64)
+    raw = raw[:ends[-1] + 1]
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    group = np.repeat(np.arange(ends.size), ends - starts + 1)
+    shift = 5 * (np.arange(raw.size) - starts[group])
+    values = np.add.reduceat((raw & 0x1F) << shift, starts)
+    deltas = np.where(values & 1, ~(values >> 1), values >> 1)
+    deltas = deltas[: deltas.size - deltas.size % 2].reshape(-1, 2)
+    return np.cumsum(deltas, axis=0) / 10.0 ** precision
+
+def simplify_path(path: np.ndarray, epsilon: float = 5e-5, min_points: int = 200) -> np.ndarray:
+    """
+    Ramer–Douglas–Peucker itératif (distances vectorisées NumPy) sur un
+    array (N, 2). epsilon en degrés : 5e-5 ≈ 5 m, invisible à l'échelle
+    d'une route mais divise le nombre de segments envoyés à Leaflet.
+    Sous min_points sommets, le tracé est rendu tel quel (rien à gagner).
+    """
+    n = len(path)
+    if n < max(3, min_points):
+        return path
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        a, b = path[i], path[j]
+        seg = path[i + 1:j] - a
+        dx, dy = b - a
+        norm = np.hypot(dx, dy)
+        if norm == 0.0:
+            dist = np.hypot(seg[:, 0], seg[:, 1])
+        else:
+            dist = np.abs(dx * seg[:, 1] - dy * seg[:, 0]) / norm
+        k = int(np.argmax(dist))
+        if dist[k] > epsilon:
+            m = i + 1 + k
+            keep[m] = True
+            stack.append((i, m))
+            stack.append((m, j))
+    return path[keep]
+
+def recency_color(ts: Optional[Union[str, datetime]], now: Optional[datetime] = None) -> Tuple[str, str]:
+    # ts : datetime (mygeotab désérialise dateTime) ou chaîne ISO
+    # now : horloge lue une fois par rendu par l'appelant (sinon à chaque appel)
     if not ts:
         return "#9e9e9e", "> 30d"
-    try:
-        dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
-    except Exception:
+    dt = parse_ts_utc(ts)
+    if dt is None:
         return "#9e9e9e", "unknown"
-    age = datetime.now(timezone.utc) - dt.astimezone(timezone.utc)
+    age = (now or datetime.now(timezone.utc)) - dt
     if age <= timedelta(hours=2):
         return "#00c853", "≤ 2h"
     if age <= timedelta(hours=24):
@@ -195,21 +260,181 @@ GOOGLE_KEY = secret("GOOGLE_MAPS_API_KEY")
 if not GOOGLE_KEY:
     st.error("Missing Google Maps key. Add it in **App settings → Secrets** as `GOOGLE_MAPS_API_KEY`.")
     st.stop()
-gmaps_client = googlemaps.Client(key=GOOGLE_KEY)
+# Un seul client (et donc une seule requests.Session / pool HTTPS) pour tout
+# le process : les reruns ne renégocient plus TLS vers maps.googleapis.com.
+# (timeout= et non requests_kwargs : le client écrase requests_kwargs["timeout"])
+# Pool HTTPS dimensionné sur thread_map (12 workers) : le pool par défaut de
+# requests (10) rejetterait des connexions keep-alive lors des géocodages parallèles.
+GMAPS_POOL_SIZE = 12
+
+@st.cache_resource(show_spinner=False)
+def get_gmaps_client(key: str) -> googlemaps.Client:
+    from requests.adapters import HTTPAdapter
+
+    client = googlemaps.Client(key=key, timeout=10)
+    client.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=GMAPS_POOL_SIZE))
+    return client
+
+gmaps_client = get_gmaps_client(GOOGLE_KEY)
+
+# ────────────────────────────────────────────────────────────────
+# GitHub RAW — session keep-alive avec retries + revalidation ETag
+# (un rechargement d'un fichier inchangé se termine en 304, sans corps)
+# ────────────────────────────────────────────────────────────────
+@st.cache_resource(show_spinner=False)
+def _github_session() -> requests.Session:
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    sess = requests.Session()
+    retry = Retry(total=3, backoff_factor=0.3, status_forcelist=(502, 503, 504), allowed_methods=("GET",))
+    sess.mount("https://", HTTPAdapter(max_retries=retry))
+    return sess
+
+@st.cache_resource(show_spinner=False)
+def _github_etags() -> Dict[str, Tuple[str, bytes]]:
+    return {}
+
+def fetch_github_raw(url: str, timeout: int = 30) -> bytes:
+    store = _github_etags()
+    known = store.get(url)
+    headers = {"If-None-Match": known[0]} if known else {}
+    r = _github_session().get(url, timeout=timeout, headers=headers)
+    if r.status_code == 304 and known:
+        return known[1]
+    r.raise_for_status()
+    etag = r.headers.get("ETag")
+    if etag:
+        store[url] = (etag, r.content)
+    return r.content
+
+# ────────────────────────────────────────────────────────────────
+# Fan-out réseau (threads) — le contexte Streamlit est propagé aux workers
+# pour que st.cache_data fonctionne sans avertissement
+# ────────────────────────────────────────────────────────────────
+def thread_map(fn, items, max_workers: int = 12) -> list:
+    items = list(items)
+    if len(items) <= 1:
+        return [fn(x) for x in items]
+    ctx = get_script_run_ctx()
+
+    def _run(x):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return fn(x)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as ex:
+        return list(ex.map(_run, items))
+
+# Plafond d'appels Geocoding simultanés pour tout le process, toutes sessions
+# confondues (évite les rafales → 429) ; cache_resource car app.py est
+# ré-exécuté à chaque rerun
+@st.cache_resource(show_spinner=False)
+def _geocode_slots() -> threading.Semaphore:
+    return threading.Semaphore(10)
+
+# ────────────────────────────────────────────────────────────────
+# Cache géocodage persistant (SQLite, direct + inverse) — survit aux redémarrages ;
+# st.cache_data reste la couche mémoire devant lui
+# ────────────────────────────────────────────────────────────────
+GEO_DB_PATH = Path(".cache") / "geocode_cache.sqlite"
+GEO_DB_TTL_SEC = 30 * 86400
+
+@st.cache_resource(show_spinner=False)
+def _get_geo_db() -> Tuple[sqlite3.Connection, threading.Lock]:
+    # Connexion + verrou créés ensemble, une fois par process : app.py est
+    # ré-exécuté à chaque rerun, un verrou de module ne protégerait qu'un rerun
+    GEO_DB_PATH.parent.mkdir(exist_ok=True)
+    conn = sqlite3.connect(str(GEO_DB_PATH), check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS geocode (
+            q TEXT PRIMARY KEY,
+            lat REAL,
+            lon REAL,
+            addr TEXT,
+            ts INTEGER
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS reverse (
+            lat REAL,
+            lon REAL,
+            addr TEXT,
+            ts INTEGER,
+            PRIMARY KEY (lat, lon)
+        )
+    """)
+    conn.commit()
+    return conn, threading.Lock()
+
+def _geo_db_get(q: str) -> Optional[Tuple[float, float, str]]:
+    try:
+        conn, lock = _get_geo_db()
+        with lock:
+            row = conn.execute(
+                "SELECT lat, lon, addr FROM geocode WHERE q=? AND ts>=?",
+                (q, int(time.time()) - GEO_DB_TTL_SEC),
+            ).fetchone()
+        return (float(row[0]), float(row[1]), row[2]) if row else None
+    except Exception:
+        return None
+
+def _geo_db_put(q: str, g: Tuple[float, float, str]) -> None:
+    try:
+        conn, lock = _get_geo_db()
+        with lock:
+            conn.execute(
+                "INSERT OR REPLACE INTO geocode(q, lat, lon, addr, ts) VALUES (?, ?, ?, ?, ?)",
+                (q, g[0], g[1], g[2], int(time.time())),
+            )
+            conn.commit()
+    except Exception:
+        pass
+
+def _rev_db_get(lat: float, lon: float) -> Optional[str]:
+    try:
+        conn, lock = _get_geo_db()
+        with lock:
+            row = conn.execute(
+                "SELECT addr FROM reverse WHERE lat=? AND lon=? AND ts>=?",
+                (lat, lon, int(time.time()) - GEO_DB_TTL_SEC),
+            ).fetchone()
+        return row[0] if row else None
+    except Exception:
+        return None
+
+def _rev_db_put(lat: float, lon: float, addr: str) -> None:
+    try:
+        conn, lock = _get_geo_db()
+        with lock:
+            conn.execute(
+                "INSERT OR REPLACE INTO reverse(lat, lon, addr, ts) VALUES (?, ?, ?, ?)",
+                (lat, lon, addr, int(time.time())),
+            )
+            conn.commit()
+    except Exception:
+        pass
 
 # ────────────────────────────────────────────────────────────────
-# Geocoding helpers (CACHED — inchangé)
+# Geocoding helpers (CACHED) — direct et inverse servis par le cache SQLite
+# (TTL 30 jours) avant tout appel Google, borné par _geocode_slots()
 # ────────────────────────────────────────────────────────────────
 @st.cache_data(ttl=60*60*24*30, show_spinner=False, max_entries=20000)
 def _geocode_cached(q: str) -> Optional[Tuple[float, float, str]]:
     if not q:
         return None
+    hit = _geo_db_get(q)
+    if hit:
+        return hit
     try:
-        res = gmaps_client.geocode(q, components={"country": "CA"}, region="ca")
+        with _geocode_slots():
+            res = gmaps_client.geocode(q, components={"country": "CA"}, region="ca")
         if res:
             loc = res[0]["geometry"]["location"]
             addr = res[0].get("formatted_address") or q
-            return float(loc["lat"]), float(loc["lng"]), addr
+            g = (float(loc["lat"]), float(loc["lng"]), addr)
+            _geo_db_put(q, g)
+            return g
     except Exception:
         pass
     return None
@@ -217,15 +442,24 @@ def _geocode_cached(q: str) -> Optional[Tuple[float, float, str]]:
 def geocode_ll(text: str) -> Optional[Tuple[float, float, str]]:
     if not text:
         return None
+    ll = parse_latlon(text)
+    if ll:
+        return ll[0], ll[1], text.strip()
     q = normalize_ca_postal(text)
     return _geocode_cached(q)
 
 @st.cache_data(ttl=60*60*24*30, show_spinner=False, max_entries=20000)
 def _reverse_geocode_cached(lat: float, lon: float) -> str:
+    # lat/lon déjà arrondis à 5 décimales par reverse_geocode() → clé SQLite stable
+    hit = _rev_db_get(lat, lon)
+    if hit:
+        return hit
     try:
         res = gmaps_client.reverse_geocode((lat, lon))
-        if res:
-            return res[0].get("formatted_address", f"{lat:.5f},{lon:.5f}")
+        if res and res[0].get("formatted_address"):
+            addr = res[0]["formatted_address"]
+            _rev_db_put(lat, lon, addr)
+            return addr
     except Exception:
         pass
     return f"{lat:.5f},{lon:.5f}"
@@ -237,6 +471,108 @@ def reverse_geocode(lat: float, lon: float) -> str:
     if lon == -0.0: lon = 0.0
     return _reverse_geocode_cached(lat, lon)
 
+# ────────────────────────────────────────────────────────────────
+# Directions (CACHED) — clé = origine/destination/waypoints/trafic + tranche
+# de 5 min du départ. Un double-clic ou un aller-retour du toggle round_trip
+# sur les mêmes entrées ne refait pas l'appel payant. _departure_dt (préfixe
+# "_") est exclu de la clé ; il reste l'heure envoyée à Google (jamais passée).
+# ────────────────────────────────────────────────────────────────
+DEPARTURE_BUCKET_SEC = 300  # = ttl : le trafic servi a au plus 5 min
+
+def bucket_departure(dt: datetime) -> int:
+    return int(dt.timestamp() // DEPARTURE_BUCKET_SEC) * DEPARTURE_BUCKET_SEC
+
+@st.cache_data(ttl=DEPARTURE_BUCKET_SEC, show_spinner=False)
+def directions_cached(origin: str, destination: str, waypoints: Optional[Tuple[str, ...]],
+                      traffic_model: str, departure_bucket: int, _departure_dt: datetime) -> list:
+    return gmaps_client.directions(
+        origin=origin,
+        destination=destination,
+        mode="driving",
+        waypoints=list(waypoints) if waypoints else None,
+        departure_time=_departure_dt,
+        traffic_model=traffic_model,
+    )
+
+# ────────────────────────────────────────────────────────────────
+# Ordre des arrêts en local (optionnel) — matrice de durées Distance Matrix
+# puis OR-Tools ; la requête Directions reçoit ensuite les waypoints déjà
+# ordonnés (sans optimize:true).
+# ────────────────────────────────────────────────────────────────
+DM_MAX_ELEMENTS = 100  # limite Google par requête (origines × destinations)
+DM_UNREACHABLE = 10**7  # durée sentinelle : élément non "OK" ou absent de la réponse
+_EMPTY: Dict[str, Any] = {}  # repli partagé (lecture seule) pour les champs absents des réponses Google
+
+@st.cache_data(ttl=DEPARTURE_BUCKET_SEC, show_spinner=False)
+def duration_matrix_cached(points: Tuple[str, ...], traffic_model: str,
+                           departure_bucket: int, _departure_dt: datetime) -> List[List[int]]:
+    n = len(points)
+    rows_per_call = max(1, DM_MAX_ELEMENTS // n)
+    matrix: List[List[int]] = []
+    for i in range(0, n, rows_per_call):
+        origins = points[i:i + rows_per_call]
+        res = gmaps_client.distance_matrix(
+            origins=list(origins),
+            destinations=list(points),
+            mode="driving",
+            departure_time=_departure_dt,
+            traffic_model=traffic_model,
+        )
+        rows = (res.get("rows") or [])[:len(origins)]
+        for row in rows:
+            out = []
+            for el in (row.get("elements") or [])[:n]:
+                dur = (el.get("duration_in_traffic") or el.get("duration") or _EMPTY) if el.get("status") == "OK" else _EMPTY
+                out.append(int(dur.get("value", DM_UNREACHABLE)))
+            # Réponse partielle : matrice toujours n × n (un index hors borne
+            # planterait dans le callback C++ d'OR-Tools)
+            out.extend([DM_UNREACHABLE] * (n - len(out)))
+            matrix.append(out)
+        matrix.extend([DM_UNREACHABLE] * n for _ in range(len(origins) - len(rows)))
+    return matrix
+
+def solve_stop_order(matrix: List[List[int]]) -> Optional[List[int]]:
+    """
+    Nœud 0 = départ, 1..k = arrêts, k+1 = arrivée. Retourne l'ordre des
+    arrêts (indices 0..k-1) ou None si OR-Tools est absent / sans solution.
+    """
+    n = len(matrix)
+    if not ORTOOLS_AVAILABLE or n < 4:
+        return None
+    try:
+        manager = pywrapcp.RoutingIndexManager(n, 1, [0], [n - 1])
+        routing = pywrapcp.RoutingModel(manager)
+
+        def duration_callback(from_idx, to_idx):
+            return matrix[manager.IndexToNode(from_idx)][manager.IndexToNode(to_idx)]
+
+        transit_idx = routing.RegisterTransitCallback(duration_callback)
+        routing.SetArcCostEvaluatorOfAllVehicles(transit_idx)
+
+        params = pywrapcp.DefaultRoutingSearchParameters()
+        params.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
+        params.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
+        params.time_limit.seconds = 2
+
+        solution = routing.SolveWithParameters(params)
+        if not solution:
+            return None
+        order = []
+        index = routing.Start(0)
+        while not routing.IsEnd(index):
+            node = manager.IndexToNode(index)
+            if 0 < node < n - 1:
+                order.append(node - 1)
+            index = solution.Value(routing.NextVar(index))
+        return order if len(order) == n - 2 else None
+    except Exception:
+        return None
+
+def leg_fields(leg: Dict[str, Any]) -> Tuple[int, int]:
+    """(durée en secondes — trafic si dispo —, distance en mètres) d'un leg Directions."""
+    dur = leg.get("duration_in_traffic") or leg.get("duration") or _EMPTY
+    return int(dur.get("value", 0)), int((leg.get("distance") or _EMPTY).get("value", 0))
+
 # ────────────────────────────────────────────────────────────────
 # [FAIBLE-2] normalize_base_job_id — une seule fonction au niveau module
 # (remplace _norm_base ET _normalize_base_job_id dupliquées)
@@ -320,36 +656,229 @@ ENTREPOTS = {
     "Mirabel": "1600 Montée Guenette, Mirabel, QC, Canada",
 }
 
+# Bit i ↔ TECHNICIANS[i] : un training "not completed" devient un int,
+# l'éligibilité (même multi-trainings) se fait en quelques opérations bit à bit.
+# Tables bâties une fois par process (cache_resource : app.py est ré-exécuté
+# à chaque rerun) ; la clé = noms de TECH_HOME, une modif de la liste les rebâtit.
+@st.cache_resource(show_spinner=False)
+def _tech_tables(names: Tuple[str, ...]) -> Tuple[Tuple[str, ...], Mapping[str, int], int]:
+    technicians = tuple(sorted(names))
+    tech_bit = {norm_name(t): 1 << i for i, t in enumerate(technicians)}
+    return technicians, MappingProxyType(tech_bit), (1 << len(technicians)) - 1
+
+TECHNICIANS, TECH_BIT, ALL_TECHS_MASK = _tech_tables(tuple(TECH_HOME))
+
+# Statuts Excel "training non complété" (comparés après strip().lower())
+_NOT_COMPLETED = frozenset(("not completed", "notcompleted", "incomplete"))
+
 # ────────────────────────────────────────────────────────────────
-# Helper map labels (inchangé)
+# Geotab : unité → chauffeur (surcharge possible via GEOTAB_DEVICE_TO_DRIVER_JSON)
 # ────────────────────────────────────────────────────────────────
-def add_labeled_marker(fmap: folium.Map, lat: float, lon: float, label: str, kind: str):
-    if kind == "wh":
-        icon = folium.Icon(color="red", icon="building", prefix="fa")
-    else:
-        icon = folium.Icon(color="blue", icon="user", prefix="fa")
+DEVICE_TO_DRIVER_RAW = {
+    "01942": "ALI-REZA SABOUR", "24735": "PATRICK BELLEFLEUR", "23731": "ÉLIE RAJOTTE-LEMAY",
+    "19004": "GEORGES YAMNA", "22736": "MARTIN BOURBONNIÈRE", "23738": "PIER-LUC CÔTÉ",
+    "24724": "LOUIS LAUZON", "23744": "BENOÎT CHARETTE", "23727": "FREDY DIAZ",
+    "23737": "ALAIN DUGUAY", "23730": "BENOÎT LARAMÉE", "24725": "CHRISTIAN DUBREUIL",
+    "23746": "MICHAEL SULTE", "24728": "FRANÇOIS RACINE", "23743": "ALEX PELLETIER-GUAY",
+    "23745": "KEVIN DURANCEAU", "23739": "MAXIME ROY",
+}
 
-    folium.Marker([lat, lon], icon=icon, popup=folium.Popup(label, max_width=320), tooltip=label).add_to(fmap)
+@st.cache_resource(show_spinner=False)
+def _split_device_map() -> Tuple[Mapping[str, str], Mapping[str, str]]:
+    """
+    (NAME2DRIVER, ID2DRIVER) — clés normalisées, calculé une fois par process
+    (secret + json.loads compris) ; "Clear cache" de Streamlit relit le secret.
+    """
+    raw = dict(DEVICE_TO_DRIVER_RAW)
+    try:
+        j = secret("GEOTAB_DEVICE_TO_DRIVER_JSON")
+        if j:
+            raw.update(json.loads(j))
+    except Exception:
+        pass
+
+    name2driver, id2driver = {}, {}
+    for k, v in raw.items():
+        nk = norm_upper(k)
+        if not nk:
+            continue
+        if len(nk) > 12 or ("-" in nk and any(c.isalpha() for c in nk)):
+            id2driver[nk] = v
+        else:
+            name2driver[nk] = v
+    return MappingProxyType(name2driver), MappingProxyType(id2driver)
+
+@st.cache_data(ttl=60*60*24, show_spinner=False)
+def geocode_points(items: Tuple[Tuple[str, str], ...]) -> List[Dict[str, Any]]:
+    """
+    Géocode un lot (nom, adresse) → [{"name", "address", "lat", "lon"}].
+    Une seule entrée de cache pour tout le lot : les reruns de la carte
+    ne refont ni boucle ni lookup par adresse. Au premier appel, les
+    adresses sont géocodées en parallèle.
+    """
+    geos = thread_map(geocode_ll, [addr for _name, addr in items])
+    points = []
+    for (name, _addr), g in zip(items, geos):
+        if g:
+            lat, lon, formatted = g
+            points.append({"name": name, "address": formatted, "lat": lat, "lon": lon})
+    return points
+
+# ────────────────────────────────────────────────────────────────
+# Helper map labels — couleurs par type + callback JS partagé
+# (cercles dessinés en canvas côté navigateur : aucun objet folium par point)
+# ────────────────────────────────────────────────────────────────
+# Fond CARTO "Positron" passé par URL : pas de résolution d'alias xyzservices à chaque carte
+CARTO_TILES_URL = "https://{s}.basemaps.cartocdn.com/light_all/{z}/{x}/{y}.png"
+CARTO_ATTR = "&copy; OpenStreetMap contributors &copy; CARTO"
+
+MARKER_COLOR = {"wh": "#b71c1c", "tech": "#1565c0"}
+
+# Étiquettes = tooltips Leaflet permanents (un nœud DOM par point, pas de DivIcon)
+MAP_LABEL_CSS = """<style>
+.map-label{padding:2px 6px;font-size:12px;font-weight:700;color:#111;
+  background:rgba(255,255,255,.95);border:1px solid #ddd;border-radius:6px;
+  box-shadow:0 1px 2px rgba(0,0,0,.25);white-space:nowrap;}
+.map-label:before{display:none;}
+</style>"""
+
+# Callback add_js_points : row = [lat, lon, couleur, étiquette, popup html]
+# → un cercle + étiquette permanente construits côté navigateur (domiciles, Geotab)
+LABELED_POINT_JS = """function (row) {
+    var m = L.circleMarker([row[0], row[1]],
+        {radius: 8, color: '#222', weight: 2, fill: true, fillColor: row[2], fillOpacity: 0.9});
+    m.bindTooltip(row[3], {permanent: true, direction: 'right', offset: [10, 0], className: 'map-label'});
+    m.bindPopup(row[4], {maxWidth: 320});
+    return m;
+}"""
+
+# Couche de points construite côté navigateur (même principe que FastMarkerCluster,
+# mais dans un simple L.featureGroup : aucun regroupement, chaque point et son
+# étiquette/numéro restent visibles à tous les niveaux de zoom)
+JS_POINTS_TEMPLATE = """
+{% macro script(this, kwargs) %}
+    var {{ this.get_name() }} = (function(){
+        var callback = {{ this.callback }};
+        var data = {{ this.data|tojson }};
+        var layer = L.featureGroup();
+        for (var i = 0; i < data.length; i++) {
+            callback(data[i]).addTo(layer);
+        }
+        layer.addTo({{ this._parent.get_name() }});
+        return layer;
+    })();
+{% endmacro %}"""
+
+def add_js_points(fmap: "folium.Map", data: List[list], callback: str) -> None:
+    from branca.element import MacroElement
+    from jinja2 import Template
+
+    layer = MacroElement()
+    layer._name = "JsPoints"
+    layer._template = Template(JS_POINTS_TEMPLATE)
+    layer.data, layer.callback = data, callback
+    layer.add_to(fmap)
+
+@st.cache_data(ttl=600, show_spinner=False)
+def tech_map_html(tech_points: Tuple[Tuple[str, float, float], ...],
+                  ent_points: Tuple[Tuple[str, float, float], ...]) -> str:
+    """
+    Carte domiciles + entrepôts (lecture seule) : HTML rendu une fois pour
+    un jeu de points donné, puis servi tel quel via components.html.
+    """
+    import folium
+
+    # Lignes JS construites une fois en Python (étiquette/popup déjà formatées)
+    data = [[lat, lon, MARKER_COLOR["wh"], f"🏭 {name}", f"🏭 {name}"] for name, lat, lon in ent_points]
+    data += [[lat, lon, MARKER_COLOR["tech"], name, name] for name, lat, lon in tech_points]
+    avg_lat, avg_lon = np.array([r[:2] for r in data], dtype=np.float64).mean(axis=0)
+    fmap = folium.Map(location=[avg_lat, avg_lon], zoom_start=8, tiles=CARTO_TILES_URL, attr=CARTO_ATTR,
+                      prefer_canvas=True)
+    fmap.get_root().header.add_child(folium.Element(MAP_LABEL_CSS))
+    # Pas de cluster : un point regroupé perd son étiquette permanente
+    add_js_points(fmap, data, LABELED_POINT_JS)
+    return fmap.get_root().render()
+
+@st.cache_data(ttl=300, show_spinner=False, max_entries=50)
+def geotab_map_html(rows: Tuple[Tuple[float, float, str, str, str], ...]) -> str:
+    """Carte Geotab (lecture seule) : rows = (lat, lon, couleur, nom court, popup html)."""
+    import folium
+
+    avg_lat, avg_lon = np.array([r[:2] for r in rows], dtype=np.float64).mean(axis=0)
+    fmap = folium.Map(location=[avg_lat, avg_lon], zoom_start=8, tiles=CARTO_TILES_URL, attr=CARTO_ATTR,
+                      prefer_canvas=True)
+    fmap.get_root().header.add_child(folium.Element(MAP_LABEL_CSS))
+    # Pas de cluster : deux véhicules proches gardent chacun l'étiquette du chauffeur
+    add_js_points(fmap, [list(r) for r in rows], LABELED_POINT_JS)
+    return fmap.get_root().render()
+
+# Callback add_js_points (arrêts de route) : row = [lat, lon, html numéro, popup html]
+ROUTE_STOP_MARKER_JS = """function (row) {
+    var m = L.marker([row[0], row[1]], {icon: L.divIcon({html: row[2], className: 'empty'})});
+    m.bindPopup(row[3], {maxWidth: 260});
+    return m;
+}"""
+
+# ────────────────────────────────────────────────────────────────
+# Carte de la route optimisée (CACHED) — HTML généré seulement si la route
+# change, pas à chaque rerun (checkbox, sélection, etc.)
+# ────────────────────────────────────────────────────────────────
+@st.cache_data(ttl=3600, show_spinner=False, max_entries=200)
+def decode_overview(overview: str) -> List[List[float]]:
+    # Décodée puis simplifiée (RDP) : les routes interurbaines font 5-20k points
+    return simplify_path(decode_polyline(overview)).tolist()
+
+@st.cache_data(show_spinner=False, max_entries=50)
+def route_map_html(overview: Optional[str], visit_texts: Tuple[str, ...],
+                   visit_lls: Tuple[Tuple[float, float], ...], round_trip: bool,
+                   _path: Optional[List[List[float]]] = None) -> str:
+    """
+    HTML complet de la carte (lecture seule) : rendu une fois par route puis
+    servi tel quel via components.html — pas de pont st_folium bidirectionnel.
+    visit_lls[i] = coordonnées de visit_texts[i] (START, arrêts, END) : aucun
+    géocodage ici, et aucune dépendance au libellé exact renvoyé par Google.
+    _path (déjà décodé au calcul de la route) est exclu de la clé : overview l'identifie.
+    """
+    import folium
+
+    start_ll, end_ll = visit_lls[0], visit_lls[-1]
+    # prefer_canvas : la polyline (des milliers de sommets) est dessinée en canvas, pas en SVG
+    fmap = folium.Map(location=[start_ll[0], start_ll[1]], zoom_start=9, tiles=CARTO_TILES_URL, attr=CARTO_ATTR,
+                      prefer_canvas=True)
+    if _path:
+        folium.PolyLine(_path, weight=7, color="#2196f3", opacity=0.9).add_to(fmap)
 
     folium.Marker(
-        [lat, lon],
-        icon=folium.DivIcon(
-            icon_size=(260, 22),
-            icon_anchor=(0, -18),
-            html=f"""
-            <div style="display:inline-block;padding:2px 6px;
-                font-size:12px;font-weight:700;color:#111;
-                background:rgba(255,255,255,.95);
-                border:1px solid #ddd;border-radius:6px;
-                box-shadow:0 1px 2px rgba(0,0,0,.25);white-space:nowrap;">
-                {label}
-            </div>
-            """
-        ),
+        start_ll,
+        icon=folium.Icon(color="green", icon="play", prefix="fa"),
+        tooltip="START",
+        popup=folium.Popup(f"<b>START</b><br>{visit_texts[0]}", max_width=260, lazy=True)
     ).add_to(fmap)
 
+    # Arrêts numérotés : un seul tableau JSON, marqueurs construits côté navigateur
+    # (pas de cluster : les numéros 1..n doivent rester visibles dès le zoom initial)
+    stop_rows = [
+        [ll[0], ll[1], big_number_marker_html(str(i)), f"<b>{i}</b>. {addr}"]
+        for i, (addr, ll) in enumerate(zip(visit_texts[1:-1], visit_lls[1:-1]), start=1)
+    ]
+    if stop_rows:
+        add_js_points(fmap, stop_rows, ROUTE_STOP_MARKER_JS)
+
+    folium.Marker(
+        end_ll,
+        icon=folium.Icon(color="red", icon="flag-checkered", prefix="fa"),
+        tooltip="END",
+        popup=folium.Popup(f"<b>{'END (Home)' if round_trip else 'END'}</b><br>{visit_texts[-1]}", max_width=260, lazy=True)
+    ).add_to(fmap)
+    return fmap.get_root().render()
+
+# Champs obligatoires de st.session_state.route_result, lus en un seul appel
+_ROUTE_RESULT_FIELDS = itemgetter("visit_texts", "km", "mins", "visit_lls", "round_trip")
+
 # ────────────────────────────────────────────────────────────────
-# PAGE 1 (Route Optimizer) — logique inchangée
+# PAGE 1 (Route Optimizer) — géocodage parallèle, ordre des arrêts par Google
+# (optimize:true) ou en local (Distance Matrix + OR-Tools, waypoints déjà
+# ordonnés) ; carte et détails des arrêts rendus seulement sur demande
 # ────────────────────────────────────────────────────────────────
 def render_page_1():
     cummins_header()
@@ -360,6 +889,9 @@ def render_page_1():
         st.markdown("**Travel mode:** Driving")
         leave_now = st.checkbox("Leave now", value=True, key="leave_now")
         round_trip = st.checkbox("Return to home at the end (round trip)?", value=True, key="round_trip")
+        st.checkbox("Order stops locally (Distance Matrix + OR-Tools)", value=False, key="local_order",
+                    disabled=not ORTOOLS_AVAILABLE,
+                    help=None if ORTOOLS_AVAILABLE else "OR-Tools n'est pas installé (pip install ortools).")
     with c2:
         traffic_model = st.selectbox("Traffic model", ["best_guess", "pessimistic", "optimistic"], index=0, key="traffic_model")
         planned_date = st.date_input("Planned departure date", value=date.today(), disabled=leave_now, key="planned_date")
@@ -372,8 +904,6 @@ def render_page_1():
     else:
         departure_dt = datetime.combine(planned_date, planned_time, tzinfo=TZ_LOCAL)
 
-    TECHNICIANS = sorted(TECH_HOME.keys())
-
     EXCEL_URL = "https://cummins365.sharepoint.com/:x:/r/sites/GRP_CC40846-AdministrationFSPG/Shared%20Documents/Administration%20FSPG/Info%20des%20techs%20pour%20booking/CapaciteTechs_CandiacEtOttawa.xlsx?d=wa4a6497bebb642849d640c57e4db82de&csf=1&web=1&e=8ltLaR"
     GITHUB_RAW_URL = "https://raw.githubusercontent.com/AR76F/route-optimizer/main/CapaciteTechs_CandiacEtOttawa.xlsx"
 
@@ -387,22 +917,23 @@ def render_page_1():
 
     if st.button("🔄 Recharger les données des trainings (GitHub)", key="refresh_trainings"):
         _get_excel_bytes_cached.clear()
+        _load_trainings_df.clear()
         get_training_options.clear()
         get_not_completed_by_col.clear()
 
     # [ÉLEVÉ-1] Bytes du fichier Excel cachés séparément — 1 seul GET HTTP
     @st.cache_data(ttl=300, show_spinner=False)
     def _get_excel_bytes_cached(url: str) -> bytes:
-        r = requests.get(url, timeout=30)
-        r.raise_for_status()
-        return r.content
+        return fetch_github_raw(url, timeout=30)
 
     def _fetch_excel_df(raw_url: str, sheet: str, header=None) -> pd.DataFrame:
         content = _get_excel_bytes_cached(raw_url)
-        return pd.read_excel(BytesIO(content), sheet_name=sheet, header=header, engine="openpyxl")
+        return pd.read_excel(BytesIO(content), sheet_name=sheet, header=header, engine=EXCEL_ENGINE)
 
-    def _norm_name(s: str) -> str:
-        return " ".join(str(s or "").strip().lower().split())
+    # Feuille "Trainings" parsée une seule fois, partagée par les deux lectures ci-dessous
+    @st.cache_data(ttl=300, show_spinner=False)
+    def _load_trainings_df() -> pd.DataFrame:
+        return _fetch_excel_df(GITHUB_RAW_URL, sheet=SHEET_NAME, header=None)
 
     def _excel_col_to_idx(col_letter: str) -> int:
         col_letter = col_letter.strip().upper()
@@ -420,34 +951,36 @@ def render_page_1():
 
     @st.cache_data(ttl=300, show_spinner=False)
     def get_training_options() -> list[tuple[str, int]]:
-        df = _fetch_excel_df(GITHUB_RAW_URL, sheet=SHEET_NAME, header=None)
+        df = _load_trainings_df()
         r = HEADER_ROW - 1
         c_start = _excel_col_to_idx(TRAINING_COL_RANGE[0])
         c_end = _excel_col_to_idx(TRAINING_COL_RANGE[1])
-        options = []
-        for c in range(c_start, c_end + 1):
-            val = df.iat[r, c] if (r < len(df) and c < df.shape[1]) else None
-            label = str(val).strip() if val is not None and str(val).strip().lower() not in ("", "nan") else ""
-            if label:
-                options.append((label, c))
-        return options
+        if r >= len(df):
+            return []
+        # Une seule tranche vectorisée de la ligne d'en-tête (index = n° de colonne)
+        labels = df.iloc[r, c_start:c_end + 1].dropna().astype(str).str.strip()
+        labels = labels[(labels != "") & (labels.str.lower() != "nan")]
+        return list(zip(labels.tolist(), labels.index.tolist()))
 
     @st.cache_data(ttl=300, show_spinner=False)
-    def get_not_completed_by_col(training_col_idx: int) -> set:
-        df = _fetch_excel_df(GITHUB_RAW_URL, sheet=SHEET_NAME, header=None)
+    def get_not_completed_by_col(training_col_idx: int) -> int:
+        df = _load_trainings_df()
         name_col_idx = _excel_col_to_idx(NAMES_COL_LETTER)
         r_start = max(0, DATA_ROW_START - 1)
         r_end = min(len(df) - 1, DATA_ROW_END - 1)
-        sub = df.iloc[r_start:r_end + 1, [name_col_idx, training_col_idx]].copy()
-        sub.columns = ["name", "status"]
-        sub["status_norm"] = sub["status"].astype(str).str.strip().str.lower()
-        not_completed_mask = sub["status_norm"].isin({"not completed", "notcompleted", "incomplete"})
-        not_completed = sub[not_completed_mask]["name"].dropna()
-        return {_norm_name(n) for n in not_completed.tolist()}
-
-    def eligible_for(training_col_idx: int):
-        not_ok_norm = get_not_completed_by_col(training_col_idx)
-        return [t for t in TECHNICIANS if _norm_name(t) not in not_ok_norm]
+        names = df.iloc[r_start:r_end + 1, name_col_idx]
+        status_norm = df.iloc[r_start:r_end + 1, training_col_idx].astype(str).str.strip().str.lower()
+        not_completed = names[status_norm.isin(_NOT_COMPLETED)].dropna()
+        mask = 0
+        for bit in not_completed.map(norm_name).map(TECH_BIT).dropna():
+            mask |= int(bit)
+        return mask
+
+    def eligible_for(*training_col_idxs: int) -> List[str]:
+        mask = ALL_TECHS_MASK
+        for col_idx in training_col_idxs:
+            mask &= ~get_not_completed_by_col(col_idx)
+        return [t for i, t in enumerate(TECHNICIANS) if mask >> i & 1]
 
     _training_pairs = get_training_options()
     _training_labels = ["(choisir)"] + [p[0] for p in _training_pairs]
@@ -490,6 +1023,7 @@ def render_page_1():
 
             @st.cache_resource(show_spinner=False)
             def _geotab_api_cached(user, pwd, db, server):
+                import mygeotab as myg
                 api = myg.API(user, pwd, db, server)
                 api.authenticate()
                 return api
@@ -500,73 +1034,65 @@ def render_page_1():
                 devs = api.call("Get", typeName="Device", search={"isActive": True}) or []
                 return [{"id": d["id"], "name": d.get("name") or d.get("serialNumber") or "unit"} for d in devs]
 
-            # [MOYEN-2] Fetch positions Geotab en parallèle avec ThreadPoolExecutor
+            def _dsi_position(did, row):
+                if not row:
+                    return {"deviceId": did, "error": "no_position"}
+                lat, lon = row.get("latitude"), row.get("longitude")
+                when = row.get("dateTime") or row.get("lastCommunicated") or row.get("workDate")
+                if (lat is None or lon is None) and isinstance(row.get("location"), dict):
+                    lat = row["location"].get("y")
+                    lon = row["location"].get("x")
+                drv = row.get("driver")
+                driver_name = drv.get("name") if isinstance(drv, dict) else None
+                if lat is not None and lon is not None:
+                    return {"deviceId": did, "lat": float(lat), "lon": float(lon),
+                            "when": when, "driverName": driver_name}
+                return {"deviceId": did, "error": "no_position"}
+
+            # [MOYEN-2] Positions Geotab : un seul Get DeviceStatusInfo (tous les véhicules)
+            # filtré côté client ; sinon MultiCall ; en dernier recours, un appel par véhicule en parallèle
             @st.cache_data(ttl=75, show_spinner=False)
             def _geotab_positions_for(api_params, device_ids, refresh_key):
                 user, pwd, db, server = api_params
                 api = _geotab_api_cached(user, pwd, db, server)
 
+                try:
+                    wanted = set(device_ids)
+                    by_id = {}
+                    for row in api.call("Get", typeName="DeviceStatusInfo") or []:
+                        did = (row.get("device") or {}).get("id")
+                        if did in wanted:
+                            by_id.setdefault(did, row)
+                    return [_dsi_position(did, by_id.get(did)) for did in device_ids]
+                except Exception:
+                    pass
+
+                # 2e essai : un seul POST ExecuteMultiCall avec un Get filtré par véhicule
+                try:
+                    batches = api.multi_call([
+                        ("Get", {"typeName": "DeviceStatusInfo", "search": {"deviceSearch": {"id": did}}})
+                        for did in device_ids
+                    ])
+                    if batches is not None and len(batches) == len(device_ids):
+                        return [_dsi_position(did, dsi[0] if dsi else None) for did, dsi in zip(device_ids, batches)]
+                except Exception:
+                    pass
+
                 def fetch_one(did):
                     try:
                         dsi = api.call("Get", typeName="DeviceStatusInfo", search={"deviceSearch": {"id": did}})
-                        lat = lon = when = None
-                        driver_name = None
-                        if dsi:
-                            row = dsi[0]
-                            lat, lon = row.get("latitude"), row.get("longitude")
-                            when = row.get("dateTime") or row.get("lastCommunicated") or row.get("workDate")
-                            if (lat is None or lon is None) and isinstance(row.get("location"), dict):
-                                lat = row["location"].get("y")
-                                lon = row["location"].get("x")
-                            drv = row.get("driver")
-                            if isinstance(drv, dict):
-                                driver_name = drv.get("name")
-                        if lat is not None and lon is not None:
-                            return {"deviceId": did, "lat": float(lat), "lon": float(lon),
-                                    "when": when, "driverName": driver_name}
-                        return {"deviceId": did, "error": "no_position"}
+                        return _dsi_position(did, dsi[0] if dsi else None)
                     except Exception:
                         return {"deviceId": did, "error": "error"}
 
-                results = []
-                with ThreadPoolExecutor(max_workers=6) as ex:
-                    futures = {ex.submit(fetch_one, did): did for did in device_ids}
-                    for f in as_completed(futures):
-                        results.append(f.result())
-                return results
-
-            DEVICE_TO_DRIVER_RAW = {
-                "01942": "ALI-REZA SABOUR", "24735": "PATRICK BELLEFLEUR", "23731": "ÉLIE RAJOTTE-LEMAY",
-                "19004": "GEORGES YAMNA", "22736": "MARTIN BOURBONNIÈRE", "23738": "PIER-LUC CÔTÉ",
-                "24724": "LOUIS LAUZON", "23744": "BENOÎT CHARETTE", "23727": "FREDY DIAZ",
-                "23737": "ALAIN DUGUAY", "23730": "BENOÎT LARAMÉE", "24725": "CHRISTIAN DUBREUIL",
-                "23746": "MICHAEL SULTE", "24728": "FRANÇOIS RACINE", "23743": "ALEX PELLETIER-GUAY",
-                "23745": "KEVIN DURANCEAU", "23739": "MAXIME ROY",
-            }
+                # Repli : un appel par véhicule, concurrence bornée à 9 (ordre d'entrée conservé)
+                with ThreadPoolExecutor(max_workers=max(1, min(9, len(device_ids)))) as ex:
+                    return list(ex.map(fetch_one, device_ids))
 
-            import json
-            try:
-                j = secret("GEOTAB_DEVICE_TO_DRIVER_JSON")
-                if j:
-                    DEVICE_TO_DRIVER_RAW.update(json.loads(j))
-            except Exception:
-                pass
-
-            def _norm(s: str) -> str:
-                return " ".join(str(s or "").strip().upper().split())
-
-            NAME2DRIVER, ID2DRIVER = {}, {}
-            for k, v in DEVICE_TO_DRIVER_RAW.items():
-                nk = _norm(k)
-                if not nk:
-                    continue
-                if len(nk) > 12 or ("-" in nk and any(c.isalpha() for c in nk)):
-                    ID2DRIVER[nk] = v
-                else:
-                    NAME2DRIVER[nk] = v
+            NAME2DRIVER, ID2DRIVER = _split_device_map()
 
             def _driver_from_mapping(device_id: str, device_name: str) -> Optional[str]:
-                n_id, n_name = _norm(device_id), _norm(device_name)
+                n_id, n_name = norm_upper(device_id), norm_upper(device_name)
                 return NAME2DRIVER.get(n_name) or ID2DRIVER.get(n_id) or ID2DRIVER.get(n_name) or NAME2DRIVER.get(n_id)
 
             def _label_for_device(device_id: str, device_name: str, driver_from_api: Optional[str]) -> str:
@@ -574,19 +1100,31 @@ def render_page_1():
                 dev_label = device_name or device_id
                 return f"{driver} — {dev_label}"
 
-            devs = _geotab_devices_cached(G_USER, G_PWD, G_DB, G_SERVER)
-            if not devs:
+            @st.cache_data(ttl=900, show_spinner=False)
+            def _device_options(devs_key: Tuple[Tuple[str, str], ...]) -> Tuple[List[str], Dict[str, str], Dict[str, str]]:
+                # Une passe : id → label (réutilisé pour les positions), label → id, liste triée
+                id2label = {did: _label_for_device(did, name, None) for did, name in devs_key}
+                label2id = {lbl: did for did, lbl in id2label.items()}
+                return sorted(label2id), label2id, id2label
+
+            # mygeotab importé ici (1re connexion) : un paquet présent mais cassé
+            # (dépendance manquante) ou une connexion refusée désactive l'onglet,
+            # sans empêcher le reste de la page de s'afficher
+            try:
+                devs, geotab_error = _geotab_devices_cached(G_USER, G_PWD, G_DB, G_SERVER), None
+            except Exception as e:
+                devs, geotab_error = [], e
+            if geotab_error is not None:
+                st.warning(f"Geotab indisponible : {type(geotab_error).__name__}: {geotab_error}")
+            elif not devs:
                 st.info("Aucun appareil actif trouvé.")
             else:
-                options, label2id = [], {}
-                for d in devs:
-                    lbl = _label_for_device(d["id"], d["name"], None)
-                    options.append(lbl)
-                    label2id[lbl] = d["id"]
+                devs_key = tuple((d["id"], d["name"]) for d in devs)
+                options, label2id, id2label = _device_options(devs_key)
 
                 picked_labels = st.multiselect(
                     "Sélectionner un ou plusieurs véhicules/techniciens à afficher :",
-                    sorted(options),
+                    options,
                     default=[],
                     key="geo_pick_labels",
                 )
@@ -594,55 +1132,37 @@ def render_page_1():
 
                 if wanted_ids:
                     pts = _geotab_positions_for((G_USER, G_PWD, G_DB, G_SERVER), tuple(wanted_ids), st.session_state.geo_refresh_key)
-                    id2name = {d["id"]: d["name"] for d in devs}
                     valid = [p for p in pts if "lat" in p and "lon" in p]
                     if valid:
-                        avg_lat = sum(p["lat"] for p in valid) / len(valid)
-                        avg_lon = sum(p["lon"] for p in valid) / len(valid)
-                        fmap = folium.Map(location=[avg_lat, avg_lon], zoom_start=8, tiles="cartodbpositron")
-
-                        choice_labels = []
+                        id2name = dict(devs_key)
+                        now_utc = datetime.now(timezone.utc)
+                        choice_labels, label_to_point, rows = [], {}, []
                         for p in valid:
                             device_id = p["deviceId"]
-                            device_name = id2name.get(device_id, device_id)
-                            label = _label_for_device(device_id, device_name, p.get("driverName"))
+                            # Label précalculé ; recalcul seulement si Geotab fournit le chauffeur
+                            drv = p.get("driverName")
+                            if drv:
+                                label = _label_for_device(device_id, id2name.get(device_id, device_id), drv)
+                            else:
+                                label = id2label.get(device_id) or _label_for_device(device_id, device_id, None)
                             choice_labels.append(label)
+                            label_to_point.setdefault(label, p)
+
+                            color, lab = recency_color(p.get("when"), now_utc)
+                            rows.append((
+                                p["lat"], p["lon"], color, label.split(' — ')[0],
+                                f"<b>{label}</b><br>Recency: {lab}<br>{p['lat']:.5f}, {p['lon']:.5f}",
+                            ))
 
-                            color, lab = recency_color(p.get("when"))
-                            folium.CircleMarker(
-                                [p["lat"], p["lon"]],
-                                radius=8, color="#222", weight=2,
-                                fill=True, fill_color=color, fill_opacity=0.9
-                            ).add_to(fmap)
-
-                            folium.Marker(
-                                [p["lat"], p["lon"]],
-                                popup=folium.Popup(
-                                    f"<b>{label}</b><br>Recency: {lab}<br>{p['lat']:.5f}, {p['lon']:.5f}",
-                                    max_width=320
-                                ),
-                                tooltip=label,
-                                icon=folium.DivIcon(
-                                    icon_size=(240, 22),
-                                    icon_anchor=(0, -18),
-                                    html=f"""
-                                    <div style="display:inline-block;padding:2px 6px;
-                                        font-size:12px;font-weight:700;color:#111;
-                                        background:rgba(255,255,255,.95);
-                                        border:1px solid #ddd;border-radius:6px;
-                                        box-shadow:0 1px 2px rgba(0,0,0,.25);white-space:nowrap;">
-                                        {label.split(' — ')[0]}
-                                    </div>"""
-                                )
-                            ).add_to(fmap)
-
-                        st_folium(fmap, height=800, width=1800)
+                        # Carte en lecture seule : HTML statique, aucun aller-retour composant → rerun
+                        components.html(geotab_map_html(tuple(rows)), height=800)
 
                         start_choice = st.selectbox("Utiliser comme point de départ :", ["(aucun)"] + choice_labels, index=0, key="geo_start_choice")
                         if start_choice != "(aucun)":
-                            chosen = valid[choice_labels.index(start_choice)]
+                            chosen = label_to_point[start_choice]
                             picked_addr = reverse_geocode(chosen["lat"], chosen["lon"])
                             st.session_state.route_start = picked_addr
+                            st.session_state.route_start_ll = (chosen["lat"], chosen["lon"], picked_addr)
                             st.success(f"Départ défini depuis **{start_choice}** → {picked_addr}")
                     else:
                         st.warning("Aucune position exploitable pour les éléments sélectionnés (essayez de rafraîchir).")
@@ -670,30 +1190,15 @@ def render_page_1():
 
         if show_map:
             try:
-                tech_points = []
-                for name, addr in TECH_HOME.items():
-                    g = geocode_ll(addr)
-                    if g:
-                        lat, lon, formatted = g
-                        tech_points.append({"name": name, "address": formatted, "lat": lat, "lon": lon})
-
-                ent_points = []
-                for ent_name, addr in ENTREPOTS.items():
-                    g = geocode_ll(addr)
-                    if g:
-                        lat, lon, formatted = g
-                        ent_points.append({"name": ent_name, "address": formatted, "lat": lat, "lon": lon})
-
-                points_all = tech_points + ent_points
-                if points_all:
-                    avg_lat = sum(p["lat"] for p in points_all) / len(points_all)
-                    avg_lon = sum(p["lon"] for p in points_all) / len(points_all)
-                    fmap = folium.Map(location=[avg_lat, avg_lon], zoom_start=8, tiles="cartodbpositron")
-                    for p in ent_points:
-                        add_labeled_marker(fmap, p["lat"], p["lon"], f"🏭 {p['name']}", kind="wh")
-                    for p in tech_points:
-                        add_labeled_marker(fmap, p["lat"], p["lon"], p["name"], kind="tech")
-                    st_folium(fmap, height=800, width=1800)
+                tech_points = geocode_points(tuple(TECH_HOME.items()))
+                ent_points = geocode_points(tuple(ENTREPOTS.items()))
+
+                if tech_points or ent_points:
+                    html = tech_map_html(
+                        tuple((p["name"], p["lat"], p["lon"]) for p in tech_points),
+                        tuple((p["name"], p["lat"], p["lon"]) for p in ent_points),
+                    )
+                    components.html(html, height=800)
                 else:
                     st.warning("Aucun point géocodé à afficher.")
             except Exception as e:
@@ -739,24 +1244,37 @@ def render_page_1():
             storage_query = normalize_ca_postal(storage_text.strip()) if storage_text else ""
             other_stops_queries = [normalize_ca_postal(s.strip()) for s in other_stops_input if s.strip()]
 
+            wp_raw = []
+            if storage_query:
+                wp_raw.append(("Storage", storage_query))
+            for i, q in enumerate(other_stops_queries, start=1):
+                wp_raw.append((f"Stop {i}", q))
+
+            # START, stockage et arrêts géocodés en parallèle (requêtes dédoublonnées)
+            # Départ posé depuis Geotab : position connue, l'adresse inverse n'est pas regéocodée
+            known = st.session_state.get("route_start_ll")
+            geo = {start_text: known} if known and known[2] == start_text else {}
+            uniq_queries = list(dict.fromkeys(q for q in [start_text] + [q for _lbl, q in wp_raw] if q and q not in geo))
+            # Lignes "lat,lon" résolues sur place : seules les vraies adresses partent au pool
+            for q in uniq_queries:
+                ll = parse_latlon(q)
+                if ll:
+                    geo[q] = (ll[0], ll[1], q)
+            uniq_queries = [q for q in uniq_queries if q not in geo]
+            geo.update(zip(uniq_queries, thread_map(geocode_ll, uniq_queries)))
+
             failures = []
-            start_g = geocode_ll(start_text)
+            start_g = geo.get(start_text)
             if not start_g:
                 failures.append(f"START: `{start_text}`")
 
-            storage_g = geocode_ll(storage_query) if storage_query else None
+            storage_g = geo.get(storage_query) if storage_query else None
             if storage_query and not storage_g:
                 failures.append(f"STORAGE: `{storage_text}`")
 
-            wp_raw = []
-            if storage_query:
-                wp_raw.append(("Storage", storage_query))
-            for i, q in enumerate(other_stops_queries, start=1):
-                wp_raw.append((f"Stop {i}", q))
-
             wp_geocoded: List[Tuple[str, str, Tuple[float, float]]] = []
             for label, q in wp_raw:
-                g = geocode_ll(q)
+                g = geo.get(q)
                 if not g:
                     failures.append(f"{label}: `{q}`")
                 else:
@@ -775,7 +1293,7 @@ def render_page_1():
             start_addr = start_g[2]
 
             wp_addrs = [addr for (_lbl, addr, _ll) in wp_geocoded]
-            wp_llstr = [to_ll_str(ll) for (_lbl, _addr, ll) in wp_geocoded]
+            wp_llstr = tuple(to_ll_str(ll) for (_lbl, _addr, ll) in wp_geocoded)
 
             if len(wp_llstr) > 23:
                 st.error("Too many stops. Google allows up to **25 total** (origin + destination + waypoints).")
@@ -783,75 +1301,111 @@ def render_page_1():
 
             if st.session_state.get("round_trip", True):
                 destination_addr = start_addr
-                destination_llstr = to_ll_str(start_ll)
-                waypoints_for_api = wp_llstr[:]
+                destination_ll = start_ll
+                waypoints_for_api = wp_llstr
             else:
                 if wp_llstr:
                     destination_addr = wp_addrs[-1]
-                    destination_llstr = wp_llstr[-1]
+                    destination_ll = wp_geocoded[-1][2]
                     waypoints_for_api = wp_llstr[:-1]
                 else:
                     if storage_g:
                         destination_addr = storage_g[2]
-                        destination_llstr = to_ll_str((storage_g[0], storage_g[1]))
+                        destination_ll = (storage_g[0], storage_g[1])
                     else:
                         destination_addr = start_addr
-                        destination_llstr = to_ll_str(start_ll)
-                    waypoints_for_api = []
-
-            wp_arg = (["optimize:true"] + waypoints_for_api) if waypoints_for_api else None
-
-            directions = gmaps_client.directions(
-                origin=to_ll_str(start_ll),
-                destination=destination_llstr,
-                mode="driving",
-                waypoints=wp_arg,
-                departure_time=departure_dt,
-                traffic_model=st.session_state.get("traffic_model", "best_guess"),
+                        destination_ll = start_ll
+                    waypoints_for_api = ()
+            destination_llstr = to_ll_str(destination_ll)
+
+            local_order = None
+            if st.session_state.get("local_order") and len(waypoints_for_api) >= 2:
+                # Option facultative : un échec (clé sans Distance Matrix, quota,
+                # timeout…) ne doit jamais bloquer la route → optimize:true de Google
+                try:
+                    matrix = duration_matrix_cached(
+                        (to_ll_str(start_ll), *waypoints_for_api, destination_llstr),
+                        st.session_state.get("traffic_model", "best_guess"),
+                        bucket_departure(departure_dt),
+                        departure_dt,
+                    )
+                    local_order = solve_stop_order(matrix)
+                except Exception:
+                    local_order = None
+                    st.warning("Local ordering unavailable — using Google's optimizer")
+
+            if local_order is not None:
+                wp_arg = tuple(waypoints_for_api[i] for i in local_order)
+            else:
+                wp_arg = ("optimize:true", *waypoints_for_api) if waypoints_for_api else None
+
+            directions = directions_cached(
+                to_ll_str(start_ll),
+                destination_llstr,
+                wp_arg,
+                st.session_state.get("traffic_model", "best_guess"),
+                bucket_departure(departure_dt),
+                departure_dt,
             )
 
             if not directions:
                 st.error("No route returned by Google Directions (driving). Try replacing postal codes with full addresses.")
-                st.json({"origin": to_ll_str(start_ll), "destination": destination_llstr, "waypoints": waypoints_for_api})
+                st.json({"origin": to_ll_str(start_ll), "destination": destination_llstr, "waypoints": list(waypoints_for_api)})
                 st.stop()
 
+            # Ordre des arrêts par index (waypoint_order) : libellé et coordonnées
+            # suivent le même index, sans table adresse → coordonnées
+            wp_lls = [tuple(ll) for (_lbl, _addr, ll) in wp_geocoded]
+            end_addr, end_ll = (start_addr, start_ll) if st.session_state.get("round_trip", True) \
+                else (destination_addr, destination_ll)
             if waypoints_for_api:
-                order = directions[0].get("waypoint_order", list(range(len(waypoints_for_api))))
+                order = local_order if local_order is not None else \
+                    directions[0].get("waypoint_order", list(range(len(waypoints_for_api))))
                 ordered_wp_addrs = [wp_addrs[i] for i in order]
+                ordered_wp_lls = [wp_lls[i] for i in order]
                 if not st.session_state.get("round_trip", True) and wp_addrs:
                     ordered_wp_addrs.append(destination_addr)
+                    ordered_wp_lls.append(tuple(destination_ll))
+            elif st.session_state.get("round_trip", True):
+                ordered_wp_addrs, ordered_wp_lls = [], []
             else:
-                ordered_wp_addrs = [] if st.session_state.get("round_trip", True) else [destination_addr]
+                ordered_wp_addrs, ordered_wp_lls = [destination_addr], [tuple(destination_ll)]
 
-            visit_texts = [start_addr] + ordered_wp_addrs + ([start_addr] if st.session_state.get("round_trip", True) else [destination_addr])
+            visit_texts = [start_addr] + ordered_wp_addrs + [end_addr]
+            visit_lls = [tuple(start_ll)] + ordered_wp_lls + [tuple(end_ll)]
 
             legs = directions[0].get("legs", [])
-            total_dist_m = sum(leg.get("distance", {}).get("value", 0) for leg in legs)
-            total_sec = sum((leg.get("duration_in_traffic") or leg.get("duration") or {}).get("value", 0) for leg in legs)
+            # Un seul passage sur legs : (durée, distance) par leg
+            fields = np.array([leg_fields(leg) for leg in legs], dtype=np.int64).reshape(-1, 2)
+            dur_sec, dist_m = fields[:, 0], fields[:, 1]
+            total_dist_m = int(dist_m.sum())
+            total_sec = int(dur_sec.sum())
             km = total_dist_m / 1000.0 if total_dist_m else 0.0
             mins = total_sec / 60.0 if total_sec else 0.0
 
-            per_leg = []
-            current_dt = departure_dt
-            for i, leg in enumerate(legs, start=1):
-                dur = leg.get("duration_in_traffic") or leg.get("duration") or {}
-                dur_sec = int(dur.get("value", 0))
-                leg_mins = round(dur_sec / 60.0)
-                dist_m = int(leg.get("distance", {}).get("value", 0))
-                dist_km = dist_m / 1000.0
-                current_dt = current_dt + timedelta(seconds=dur_sec)
-                arr_str = current_dt.strftime("%H:%M")
-                stop_addr = visit_texts[i] if i < len(visit_texts) else ""
-                per_leg.append({"idx": i, "to": stop_addr, "dist_km": dist_km, "mins": leg_mins, "arrive": arr_str})
+            # Heures d'arrivée en epoch (int64) : départ + cumul NumPy des durées.
+            # fromtimestamp() respecte aussi un changement d'heure (DST) en cours de route.
+            arrival_epochs = int(departure_dt.timestamp()) + np.cumsum(dur_sec)
+            leg_mins = np.rint(dur_sec / 60.0).astype(np.int64)
+            per_leg = [
+                {
+                    "idx": i,
+                    "to": visit_texts[i] if i < len(visit_texts) else "",
+                    "dist_km": int(d) / 1000.0,
+                    "mins": int(m),
+                    "arrive": datetime.fromtimestamp(int(a), TZ_LOCAL).strftime("%H:%M"),
+                }
+                for i, (d, m, a) in enumerate(zip(dist_m, leg_mins, arrival_epochs), start=1)
+            ]
 
             st.session_state.route_result = {
                 "visit_texts": visit_texts,
                 "km": km,
                 "mins": mins,
-                "start_ll": start_ll,
-                "wp_geocoded": wp_geocoded,
+                "visit_lls": tuple(visit_lls),  # START et END inclus : la carte n'a jamais à géocoder
                 "round_trip": st.session_state.get("round_trip", True),
                 "overview": directions[0].get("overview_polyline", {}).get("points"),
+                "overview_path": None,
                 "per_leg": per_leg,
             }
 
@@ -861,76 +1415,46 @@ def render_page_1():
 
     res = st.session_state.get("route_result")
     if res:
-        visit_texts = res["visit_texts"]
-        km = res["km"]
-        mins = res["mins"]
-        start_ll = tuple(res["start_ll"])
-        wp_geocoded = res["wp_geocoded"]
-        round_trip_res = res["round_trip"]
-        overview = res.get("overview")
-        per_leg = res.get("per_leg", [])
-
-        st.markdown("#### Optimized order (Driving)")
-        for ix, addr in enumerate(visit_texts):
-            if ix == 0:
-                st.write(f"**START** — {addr}")
-            elif ix == len(visit_texts) - 1:
-                st.write(f"**END** — {addr}")
-            else:
-                st.write(f"**{ix}** — {addr}")
+        visit_texts, km, mins, visit_lls, round_trip_res = _ROUTE_RESULT_FIELDS(res)
+        overview, per_leg = res.get("overview"), res.get("per_leg", [])
+
+        st.success(f"**Total distance:** {km:.1f} km • **Total time:** {mins:.0f} mins (live traffic)")
 
-        if per_leg:
-            st.markdown("#### Stop-by-stop timing")
-            for leg in per_leg:
-                st.write(f"**{leg['idx']}** → _{leg['to']}_  •  {leg['dist_km']:.1f} km  •  {leg['mins']} mins  •  **ETA {leg['arrive']}**")
+        # Détails repliés par défaut : rien n'est formaté tant que la case n'est pas cochée
+        # (Streamlit exécute quand même le contenu d'un expander fermé).
+        show_legs = st.checkbox("Show stop details", value=False, key="show_legs")
+        if show_legs:
+            # Un seul st.markdown par liste (1 message front-end au lieu d'un par arrêt)
+            with st.expander("Optimized order (Driving)", expanded=True):
+                last_ix = len(visit_texts) - 1
+                st.markdown("\n\n".join(
+                    f"**{'START' if ix == 0 else 'END' if ix == last_ix else ix}** — {addr}"
+                    for ix, addr in enumerate(visit_texts)
+                ))
+
+            if per_leg:
+                with st.expander("Stop-by-stop timing", expanded=True):
+                    st.markdown("\n\n".join(
+                        f"**{leg['idx']}** → _{leg['to']}_  •  {leg['dist_km']:.1f} km  •  {leg['mins']} mins  •  **ETA {leg['arrive']}**"
+                        for leg in per_leg
+                    ))
 
         show_map2 = st.checkbox("Show map", value=False, key="route_show_map")
         if show_map2:
             try:
-                fmap = folium.Map(location=[start_ll[0], start_ll[1]], zoom_start=9, tiles="cartodbpositron")
-                if overview:
-                    try:
-                        path = polyline.decode(overview)
-                        folium.PolyLine(path, weight=7, color="#2196f3", opacity=0.9).add_to(fmap)
-                    except Exception:
-                        pass
-
-                folium.Marker(
-                    start_ll,
-                    icon=folium.Icon(color="green", icon="play", prefix="fa"),
-                    popup=folium.Popup(f"<b>START</b><br>{visit_texts[0]}", max_width=260)
-                ).add_to(fmap)
-
-                addr2ll = {addr: ll for (_lbl, addr, ll) in wp_geocoded}
-                for i, addr in enumerate(visit_texts[1:-1], start=1):
-                    ll = addr2ll.get(addr)
-                    if ll:
-                        folium.Marker(
-                            ll,
-                            popup=folium.Popup(f"<b>{i}</b>. {addr}", max_width=260),
-                            icon=big_number_marker(str(i))
-                        ).add_to(fmap)
-
-                end_addr = visit_texts[-1]
-                end_ll = addr2ll.get(end_addr)
-                if not end_ll:
-                    g = geocode_ll(end_addr)
-                    if g:
-                        end_ll = (g[0], g[1])
-
-                if end_ll:
-                    folium.Marker(
-                        end_ll,
-                        icon=folium.Icon(color="red", icon="flag-checkered", prefix="fa"),
-                        popup=folium.Popup(f"<b>{'END (Home)' if round_trip_res else 'END'}</b><br>{end_addr}", max_width=260)
-                    ).add_to(fmap)
-
-                st_folium(fmap, height=800, width=1800)
+                # Polyline décodée seulement si la carte est affichée, puis gardée dans
+                # route_result : au plus un décodage par route
+                path = res.get("overview_path")
+                if path is None and overview:
+                    path = res["overview_path"] = decode_overview(overview)
+                html = route_map_html(
+                    overview, tuple(visit_texts), visit_lls, round_trip_res,
+                    _path=path,
+                )
+                components.html(html, height=800)
             except Exception as e:
                 st.warning(f"Map rendering skipped: {e}")
 
-        st.success(f"**Total distance:** {km:.1f} km • **Total time:** {mins:.0f} mins (live traffic)")
-
 # ────────────────────────────────────────────────────────────────
 # PAGE 2 (Planning)
 # ────────────────────────────────────────────────────────────────
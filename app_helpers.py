@@ -0,0 +1,81 @@
+"""
+app_helpers.py — fonctions pures (texte) utilisées par app.py
+
+Module importé, pas exécuté : Streamlit ré-exécute app.py à chaque rerun,
+mais ce module reste dans sys.modules — les lru_cache ci-dessous survivent
+donc d'un rerun à l'autre (et sont partagés par toutes les sessions).
+"""
+
+import re
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Optional, Tuple, Union
+
+# Code postal canadien strict (A1A 1A1) — un seul match au lieu de strip/upper/isalnum
+_CA_POSTAL = re.compile(r"^\s*([A-Za-z]\d[A-Za-z])\s*(\d[A-Za-z]\d)\s*$")
+
+
+@lru_cache(maxsize=2048)
+def normalize_ca_postal(text: str) -> str:
+    if not text:
+        return text
+    m = _CA_POSTAL.match(str(text))
+    if m:
+        return f"{m.group(1).upper()} {m.group(2).upper()}, Canada"
+    return text
+
+
+# Coordonnées "lat,lon" déjà saisies (ou repli de reverse_geocode) : pas besoin de Google
+_LATLON = re.compile(r"^\s*(-?\d{1,2}(?:\.\d+)?)\s*,\s*(-?\d{1,3}(?:\.\d+)?)\s*$")
+
+
+@lru_cache(maxsize=2048)
+def parse_latlon(text: str) -> Optional[Tuple[float, float]]:
+    m = _LATLON.match(str(text))
+    if not m:
+        return None
+    lat, lon = float(m.group(1)), float(m.group(2))
+    if -90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0:
+        return lat, lon
+    return None
+
+
+@lru_cache(maxsize=512)
+def parse_ts_utc(ts: Union[str, datetime]) -> Optional[datetime]:
+    # Horodatage Geotab → datetime UTC. mygeotab renvoie déjà un datetime
+    # (object_deserializer) ; une chaîne ISO ("...Z") reste acceptée.
+    # Sans fuseau = UTC (convention Geotab).
+    try:
+        dt = ts if isinstance(ts, datetime) else datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    except Exception:
+        return None
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+@lru_cache(maxsize=1024)
+def norm_name(s: str) -> str:
+    return " ".join(str(s or "").strip().lower().split())
+
+
+@lru_cache(maxsize=1024)
+def norm_upper(s: str) -> str:
+    # Clé Geotab (ids / noms d'unités) : mêmes entrées à chaque rerun
+    return " ".join(str(s or "").strip().upper().split())
+
+
+@lru_cache(maxsize=512)
+def big_number_marker_html(n: str, color_hex: str = "#cc3333") -> str:
+    # HTML mémoïsé ; l'icône est créée côté navigateur (L.divIcon)
+    return f"""
+    <div style="
+      background:{color_hex};
+      color:white;
+      border-radius:18px;
+      width:36px;height:36px;
+      display:flex;align-items:center;justify-content:center;
+      font-weight:700;font-size:16px;border:2px solid #222;">
+      {n}
+    </div>
+    """